@@ -41,27 +41,72 @@ class Bound(IntEnum):
 class Direction(IntEnum):
     EXPAND, SHRINK = range(2)
 
+class Op(IntEnum):
+    """
+    Elementary ops of a compiled ADR sampling program, r is the register file
+    MUL_CONST: r[dst] = r[src] * const
+    ADD_CONST: r[dst] = r[src] + const
+    ABS:       r[dst] = |r[src]|
+    G:         r[dst] = g(r[src])
+    EXP:       r[dst] = e^r[src]
+    MUL:       r[dst] = r[src] * r[src2]
+    ADD:       r[dst] = r[src] + r[src2]
+    """
+    MUL_CONST, ADD_CONST, ABS, G, EXP, MUL, ADD = range(7)
+
 """
 Defined in Appendix B of ADR paper
+Works on scalars and arrays, pass out to write an array result in place
 """
-def g_func(x):
-    return np.exp(x - 1)
+def g_func(x, out=None):
+    return np.exp(np.subtract(x, 1, out=out), out=out)
 
 class ADRParam():
     """
     Automatic Domain Randomization single parameter
     Contains a value, min-max bounds, a delta, a performance queue, and a sampling weight
     """
+    # update() runs once per parameter per episode, fixed slots keep its attribute reads and writes cheap
+    __slots__ = (
+        "value", "_lo", "_hi", "delta", "pq_size", "_pq_count", "_pq_sum",
+        "_boundary_sample_weight", "boundary_sample_flag", "name",
+    )
+
+    # Bumped whenever any boundary sample weight changes so ADR knows to renormalize its cached weights
+    weights_version = 0
+
     def __init__(self, value, val_bound=[-math.inf, math.inf], delta=0.02, pq_size=240, boundary_sample_weight=1, name=""):
         self.value = value 
         self.val_bound = val_bound 
         self.delta = delta
         self.pq_size = pq_size 
-        self.pq = [] 
+        # Only the average of the performance queue is ever used, so it is kept as a running sum and count
+        # a pq_size of 0 updates on every value
+        self._pq_count = 0
+        self._pq_sum = 0.0
         self.boundary_sample_weight = boundary_sample_weight 
         self.boundary_sample_flag = False 
         self.name = name 
     
+    # val_bound is stored unpacked so update() doesn't index a list with an IntEnum on every call
+    @property
+    def val_bound(self):
+        return [self._lo, self._hi]
+
+    @val_bound.setter
+    def val_bound(self, val_bound):
+        self._lo, self._hi = float(val_bound[Bound.LOWER]), float(val_bound[Bound.UPPER])
+
+    # ADR caches the normalized weights, so every assignment bumps weights_version
+    @property
+    def boundary_sample_weight(self):
+        return self._boundary_sample_weight
+
+    @boundary_sample_weight.setter
+    def boundary_sample_weight(self, weight):
+        self._boundary_sample_weight = weight
+        ADRParam.weights_version += 1
+
     @staticmethod
     def fixed_boundary(val):
         """
@@ -75,18 +120,51 @@ class ADRParam():
         )
     """
     Takes a performance value, updates it pq is full based on average performance over pq_size updates
+    p_lo and p_hi are the performance thresholds, i.e. ADR.p_thresh
+    """
+    def update(self, p_val, p_lo, p_hi):
+        count = self._pq_count + 1
+        pq_sum = self._pq_sum + p_val
+        if count < self.pq_size:
+            self._pq_count = count
+            self._pq_sum = pq_sum
+            return
+        self._pq_count = 0
+        self._pq_sum = 0.0
+        self._apply_pq_avg(pq_sum / count, p_lo, p_hi)
+
     """
-    def update(self, p_val, p_thresh):
-        self.pq.append(p_val)
-        if len(self.pq) >= self.pq_size:
-            pq_avg = np.mean(self.pq)
-            self.pq = [] 
-            if pq_avg < p_thresh[Bound.LOWER]:
-                self.value -= self.delta 
-            elif pq_avg > p_thresh[Bound.UPPER]:
-                self.value += self.delta
-            
-            self.value = np.clip(self.value, self.val_bound[Bound.LOWER], self.val_bound[Bound.UPPER])
+    Same as calling update on every value of p_vals in order, but each full pq is summed in one vectorized op
+    """
+    def update_batch(self, p_vals, p_lo, p_hi):
+        p_vals = np.asarray(p_vals, dtype=np.float64)
+        pq_size = max(self.pq_size, 1)
+        # ends[k] is the index just past the values that fill the k-th pq, the first one is topped up from the current pq
+        ends = np.arange(pq_size - self._pq_count, len(p_vals) + 1, pq_size)
+        if len(ends) == 0:
+            self._pq_count += len(p_vals)
+            self._pq_sum += float(p_vals.sum())
+            return
+
+        starts = np.concatenate([[0], ends[:-1]])
+        sums = np.add.reduceat(p_vals[:ends[-1]], starts)
+        sums[0] += self._pq_sum
+        for pq_avg in (sums / pq_size).tolist():
+            self._apply_pq_avg(pq_avg, p_lo, p_hi)
+
+        tail = p_vals[ends[-1]:]
+        self._pq_count = len(tail)
+        self._pq_sum = float(tail.sum())
+
+    def _apply_pq_avg(self, pq_avg, p_lo, p_hi):
+        if pq_avg < p_lo:
+            self.value -= self.delta 
+        elif pq_avg > p_hi:
+            self.value += self.delta
+        
+        # Plain comparisons, np.clip on a scalar costs a full ufunc dispatch
+        value = self.value
+        self.value = self._lo if value < self._lo else (self._hi if value > self._hi else value)
     
     def get_boundary_sample_flag(self):
         return self.boundary_sample_flag
@@ -97,6 +175,9 @@ class ADRParam():
     def get_boundary_sample_weight(self):
         return self.boundary_sample_weight
 
+    def set_boundary_sample_weight(self, weight):
+        self.boundary_sample_weight = weight
+
     """
     Returns value
     """
@@ -116,11 +197,22 @@ class ADRDist():
         self.last_sample = None
         self.parameters = None
         self.name = ""
+        self._rng = np.random.default_rng()
 
     # self.parameters should be list of ADRParam objects
     def get_parameters(self):
         return self.parameters
 
+    # The ADRDists this distribution samples from, empty for base distributions
+    def get_dependencies(self):
+        return []
+
+    # Shares a numpy Generator with this distribution and everything it samples from
+    def set_rng(self, rng):
+        self._rng = rng
+        for dep in self.get_dependencies():
+            dep.set_rng(rng)
+
     # Samples used to construct a single instance of the environment, i.e. a single lambda_i in env(lambda) ~ P(phi)
     def episode_sample(self): 
         raise NotImplementedError
@@ -155,7 +247,8 @@ class ADRUniform(ADRDist):
             if param.get_boundary_sample_flag():
                 param.set_boundary_sample_flag(False)
                 self.last_sample = param.get_value()
-        self.last_sample = np.random.uniform(self.phi_l.get_value(), self.phi_h.get_value())
+                return self.last_sample
+        self.last_sample = self._rng.uniform(self.phi_l.get_value(), self.phi_h.get_value())
         return self.last_sample #return for convienience
     
     @staticmethod
@@ -220,12 +313,15 @@ class ADRAdditiveGaussian(ADRDist):
         self.x_0 = x_0
         self.lam_i = lam_i 
         self.lam_j = lam_j 
-        self.alpha
-        self.parameters = [self.lam_i.get_parameters() + self.lam_j.get_parameters]
+        self.alpha = alpha
+        self.parameters = self.lam_i.get_parameters() + self.lam_j.get_parameters()
+
+    def get_dependencies(self):
+        return [self.lam_i, self.lam_j]
     
     def episode_sample(self):
         self.last_sample = self.x_0 + np.abs(
-            np.random.normal(
+            self._rng.normal(
                 g_func(
                     self.alpha * self.lam_i.episode_sample()
                     ),
@@ -250,8 +346,11 @@ class ADRUnbiasedAdditiveGaussian(ADRDist):
         self.alpha = alpha 
         self.parameters = self.lam_i.get_parameters() 
 
+    def get_dependencies(self):
+        return [self.lam_i]
+
     def episode_sample(self):
-        self.last_sample = self.x_0 + np.random.normal(
+        self.last_sample = self.x_0 + self._rng.normal(
             0,
             g_func(
                 np.abs(
@@ -272,11 +371,14 @@ class ADRMultiplicative(ADRDist):
         self.lam_i = lam_i 
         self.lam_j = lam_j 
         self.alpha = alpha 
-        self.parameters = self.lam_i.get_parameters() + self.lam_j.get_parameters  
+        self.parameters = self.lam_i.get_parameters() + self.lam_j.get_parameters()
+
+    def get_dependencies(self):
+        return [self.lam_i, self.lam_j]
     
     def episode_sample(self):
         self.last_sample = self.x_0 * np.exp(
-            np.random.normal(
+            self._rng.normal(
                 self.alpha * self.lam_i.episode_sample(),
                 np.abs(
                     self.alpha * self.lam_j.episode_sample()
@@ -299,7 +401,10 @@ class ADRActionNoise(ADRDist):
         self.lam_i = lam_i 
         self.lam_j = lam_j 
         self.lam_k = lam_k 
-        self.parameters = self.lam_i.get_parameters() + self.lam_j.get_parameters + self.lam_k.get_parameters
+        self.parameters = self.lam_i.get_parameters() + self.lam_j.get_parameters() + self.lam_k.get_parameters()
+
+    def get_dependencies(self):
+        return [self.lam_i, self.lam_j, self.lam_k]
 
     def episode_sample(self):
         self.lam_i.episode_sample() 
@@ -307,36 +412,78 @@ class ADRActionNoise(ADRDist):
         return self.step_sample()
     
     def step_sample(self):
-        self.last_sample = a_0 * np.random.normal(
-            1,
-            g_func(
-                np.abs(
-                    self.lam_i.get_last_sample()
+        self.last_sample = (
+            self.a_0 * self._rng.normal(
+                1,
+                g_func(
+                    np.abs(
+                        self.lam_i.get_last_sample()
+                    )
                 )
-            )
-        ) 
-        + np.random.normal(
-            0,
-            g_func(
-                np.abs(
-                    self.lam_j.get_last_sample()
+            ) 
+            + self._rng.normal(
+                0,
+                g_func(
+                    np.abs(
+                        self.lam_j.get_last_sample()
+                    )
                 )
             )
-        )
-        + np.random.normal(
-            0,
-            g_func(
-                np.abs(
-                    self.lam_k.episode_sample()
+            + self._rng.normal(
+                0,
+                g_func(
+                    np.abs(
+                        self.lam_k.episode_sample()
+                    )
                 )
             )
         )
         return self.last_sample
 
 
+# ADRDists the sampling program computes
+_GAUSSIANS = (ADRAdditiveGaussian, ADRUnbiasedAdditiveGaussian, ADRMultiplicative)
+
+
+def _episode_sample_kernel(z_offset, n_z, program, regs, rng):
+    """
+    Array only sampling core, runs a compiled sampling program over the register file regs.
+    ADR.episode_sample uses a sampler generated from the same program, this generic version backs the batched path.
+    regs is either (n_regs,) for a single episode or (n_regs, batch_size) for a batch of independent episodes.
+    regs[:z_offset] must already hold the samples of the ADRUniforms and any other ADRDists.
+    Every (op, src, src2, dst, const) step of program is independent within itself, so each is one vectorized op.
+    """
+    batched = regs.ndim > 1
+    # N(mu, sigma) = mu + sigma * N(0, 1), so every gaussian shares one standard normal draw
+    z = regs[z_offset:z_offset + n_z]
+    z[:] = rng.standard_normal(z.shape)
+
+    for op, src, src2, dst, const in program:
+        if batched:
+            const = const[:, None]
+        if op == Op.MUL_CONST:
+            regs[dst] = regs[src] * const
+        elif op == Op.ADD_CONST:
+            regs[dst] = regs[src] + const
+        elif op == Op.ABS:
+            regs[dst] = np.abs(regs[src])
+        elif op == Op.G:
+            x = regs[src]
+            regs[dst] = g_func(x, out=x)
+        elif op == Op.EXP:
+            regs[dst] = np.exp(regs[src])
+        elif op == Op.MUL:
+            regs[dst] = regs[src] * regs[src2]
+        else:
+            regs[dst] = regs[src] + regs[src2]
+
+
 class ADR():
 
-    def __init__(self, distributions, p_thresh=[0, 10]):
+    def __init__(self, distributions, p_thresh=[0, 10], rng=None):
+        """
+        rng can be a seed or a numpy Generator, it is shared with every distribution for reproducible sampling
+        """
         super().__init__()
         self.distribution_dict = ADR.construct_dict(distributions)
         self.p_thresh = p_thresh 
@@ -345,8 +492,17 @@ class ADR():
         self.distributions = distributions
         for dist in self.distributions:
             self.parameters += dist.get_parameters()
+        assert all(isinstance(param, ADRParam) for param in self.parameters), "ADRDist.parameters must only hold ADRParams"
         
         self.do_boundary_sample = True 
+        self._rng = np.random.default_rng(rng)
+        for dist in self.distributions:
+            dist.set_rng(self._rng)
+        self._weights_cache = None
+        self._cumweights = None
+        self._samplable_idx = None
+        self._weights_version = None
+        self._build_graph()
 
     @staticmethod
     def construct_dict(distributions):
@@ -360,19 +516,311 @@ class ADR():
         
         return distribution_dict
 
+    # Same deal as ADRParam.val_bound, kept as two floats for update()
+    @property
+    def p_thresh(self):
+        return [self._p_thresh_lo, self._p_thresh_hi]
+
+    @p_thresh.setter
+    def p_thresh(self, p_thresh):
+        self._p_thresh_lo, self._p_thresh_hi = float(p_thresh[Bound.LOWER]), float(p_thresh[Bound.UPPER])
+
+    def _build_graph(self):
+        """
+        Flattens every distribution reachable from self.distributions into a single vector of nodes so an episode
+        can be sampled with one uniform draw, one normal draw, and a compiled program of vectorized ops.
+        Node order is [ADRUniforms, other ADRDists, gaussian family in topological order].
+        Other ADRDists are treated as leaves and sample themselves. An ADRActionNoise whose lam_i and lam_j are
+        ADRUniforms or gaussians has them sampled with the rest, then runs step_sample on them so its episode values
+        match their last_sample. On ADRUniforms it runs before the kernel, otherwise after it, so it sits at the end
+        of the other ADRDists. lam_k is step sampled, so it is left to sample itself.
+        Any other ADRDist, or an ADRActionNoise on gaussians that a gaussian depends on, runs its own episode_sample.
+        """
+        self._uniform = []
+        self._gauss_additive = []
+        self._gauss_unbiased = []
+        self._mult = []
+        self._others = []
+        levels = {}
+        feeds_gaussian = set()
+
+        def visit(dist):
+            if dist in levels:
+                return levels[dist]
+            if isinstance(dist, _GAUSSIANS):
+                feeds_gaussian.update(dist.get_dependencies())
+                levels[dist] = 1 + max(visit(dep) for dep in dist.get_dependencies())
+                if isinstance(dist, ADRAdditiveGaussian):
+                    self._gauss_additive.append(dist)
+                elif isinstance(dist, ADRUnbiasedAdditiveGaussian):
+                    self._gauss_unbiased.append(dist)
+                else:
+                    self._mult.append(dist)
+            else:
+                levels[dist] = 0
+                if isinstance(dist, ADRUniform):
+                    self._uniform.append(dist)
+                else:
+                    self._others.append(dist)
+                    if self._samples_from_graph(dist):
+                        visit(dist.lam_i)
+                        visit(dist.lam_j)
+            return levels[dist]
 
-    def episode_sample(self):
-        lam = [] 
         for dist in self.distributions:
-            lam.append(dist.episode_sample())
-        return lam 
+            visit(dist)
+
+        # An ADRActionNoise on gaussians runs after the kernel, so only if no gaussian reads it
+        self._graph_noise = {
+            dist for dist in self._others if self._samples_from_graph(dist)
+            and (self._samples_before_kernel(dist) or dist not in feeds_gaussian)
+        }
+        self._post_noise = [dist for dist in self._others
+                            if dist in self._graph_noise and not self._samples_before_kernel(dist)]
+        self._others = [dist for dist in self._others if dist not in self._post_noise] + self._post_noise
+
+        gaussians = sorted(self._gauss_additive + self._gauss_unbiased + self._mult, key=lambda dist: levels[dist])
+        self._nodes = self._uniform + self._others + gaussians
+        self._node_idx = node_idx = {dist: i for i, dist in enumerate(self._nodes)}
+        self._top_idx = np.array([node_idx[dist] for dist in self.distributions], dtype=np.intp)
+        self._gauss_offset = len(self._uniform) + len(self._others)
+        self._post_offset = self._gauss_offset - len(self._post_noise)
+        self._sample_fns = tuple(
+            dist.step_sample if dist in self._graph_noise else dist.episode_sample
+            for dist in self._others[:len(self._others) - len(self._post_noise)]
+        )
+
+        # (ADRUniform index, Bound) of every entry in self.parameters that the kernel samples, None for the rest
+        # boundary_sample sets _boundary_override from this and the next episode_sample consumes it
+        slots = {}
+        for k, dist in enumerate(self._uniform):
+            slots.setdefault(dist.phi_l, (k, Bound.LOWER))
+            slots.setdefault(dist.phi_h, (k, Bound.UPPER))
+        self._boundary_slots = [slots.get(param) for param in self.parameters]
+        # Shared ADRParams show up at several indices of self.parameters, update_batch groups them by first index
+        first_idx = {}
+        self._param_first_idx = np.array([first_idx.setdefault(param, k) for k, param in enumerate(self.parameters)],
+                                         dtype=np.intp)
+        self._boundary_override = None
+
+        self._phi_l_params = [dist.phi_l for dist in self._uniform]
+        self._phi_h_params = [dist.phi_h for dist in self._uniform]
+        self.phi_l_vals = np.array([param.value for param in self._phi_l_params], dtype=np.float64)
+        self.phi_h_vals = np.array([param.value for param in self._phi_h_params], dtype=np.float64)
+        self._compile_graph(gaussians, node_idx)
+        self._compile_specialized_sampler()
+
+    @staticmethod
+    def _samples_from_graph(dist):
+        return (isinstance(dist, ADRActionNoise)
+                and isinstance(dist.lam_i, (ADRUniform,) + _GAUSSIANS) and isinstance(dist.lam_j, (ADRUniform,) + _GAUSSIANS))
+
+    @staticmethod
+    def _samples_before_kernel(dist):
+        return isinstance(dist, ADRActionNoise) and isinstance(dist.lam_i, ADRUniform) and isinstance(dist.lam_j, ADRUniform)
+
+    def _step_sample_batch(self, dist, regs, k):
+        """
+        Runs an ADRActionNoise once per episode of a batch, with lam_i and lam_j set to that episode's samples.
+        """
+        lam_i, lam_j = self._node_idx[dist.lam_i], self._node_idx[dist.lam_j]
+        for b in range(regs.shape[1]):
+            dist.lam_i.last_sample, dist.lam_j.last_sample = regs[lam_i, b], regs[lam_j, b]
+            regs[k, b] = dist.step_sample()
+
+    def _compile_graph(self, gaussians, node_idx):
+        """
+        Lowers the gaussian family distributions into a program of elementary Ops over a register file laid out as
+        [nodes, one standard normal per gaussian, temporaries], so gaussian outputs land in their node slots.
+        Each op is scheduled at the earliest stage its inputs allow, and ops are grouped by (stage, Op) so every
+        group only reads registers written by earlier groups.
+        """
+        self._z_offset = len(self._nodes)
+        stage = [0] * (len(self._nodes) + len(gaussians))
+        ops = []
+
+        def emit(op, src, src2=-1, const=0.0, dst=None):
+            if dst is None:
+                dst = len(stage)
+                stage.append(0)
+            stage[dst] = 1 + max(stage[src], stage[src2] if src2 >= 0 else 0)
+            ops.append((stage[dst], op, src, src2, dst, const))
+            return dst
+
+        for k, dist in enumerate(gaussians):
+            deps = dist.get_dependencies()
+            lam_i, lam_j = node_idx[deps[0]], node_idx[deps[-1]]
+            z = self._z_offset + k
+            out = node_idx[dist]
+            if isinstance(dist, ADRAdditiveGaussian):
+                # x_0 + |N(g(a*lam_i), g(|a*lam_j|))|
+                mu = emit(Op.G, emit(Op.MUL_CONST, lam_i, const=dist.alpha))
+                sigma = emit(Op.G, emit(Op.ABS, emit(Op.MUL_CONST, lam_j, const=dist.alpha)))
+                n = emit(Op.ADD, mu, emit(Op.MUL, sigma, z))
+                emit(Op.ADD_CONST, emit(Op.ABS, n), const=dist.x_0, dst=out)
+            elif isinstance(dist, ADRUnbiasedAdditiveGaussian):
+                # x_0 + N(0, g(|a*lam_i|))
+                sigma = emit(Op.G, emit(Op.ABS, emit(Op.MUL_CONST, lam_i, const=dist.alpha)))
+                emit(Op.ADD_CONST, emit(Op.MUL, sigma, z), const=dist.x_0, dst=out)
+            else:
+                # x_0 * e^N(a*lam_i, |a*lam_j|)
+                mu = emit(Op.MUL_CONST, lam_i, const=dist.alpha)
+                sigma = emit(Op.ABS, emit(Op.MUL_CONST, lam_j, const=dist.alpha))
+                n = emit(Op.ADD, mu, emit(Op.MUL, sigma, z))
+                emit(Op.MUL_CONST, emit(Op.EXP, n), const=dist.x_0, dst=out)
+
+        ops.sort(key=lambda op: op[:2])
+        self._ops = np.array([op[1:5] for op in ops], dtype=np.int32).reshape(-1, 4)
+        self._op_const = np.array([op[5] for op in ops], dtype=np.float64)
+        self._program = []
+        start = 0
+        for stop in range(1, len(ops) + 1):
+            if stop == len(ops) or ops[stop][:2] != ops[start][:2]:
+                self._program.append((
+                    Op(ops[start][1]),
+                    self._ops[start:stop, 1],
+                    self._ops[start:stop, 2],
+                    self._ops[start:stop, 3],
+                    self._op_const[start:stop],
+                ))
+                start = stop
+        self._regs = np.empty(len(stage), dtype=np.float64)
+
+    def _compile_specialized_sampler(self):
+        """
+        The sampling program never changes after construction, so episode_sample runs it as generated straight line
+        code rather than through _episode_sample_kernel's dispatch loop. Single register ops are emitted with literal
+        indices and constants, wider ones reference their index/const arrays by name.
+        The generated source is kept in _sampler_source for debugging.
+        """
+        n_z = len(self._nodes) - self._gauss_offset
+        namespace = {"np": np, "g_func": g_func, "inf": math.inf, "nan": math.nan}
+        lines = ["def _sampler(rng, r):"]
+        if n_z:
+            lines.append("    r[{}:{}] = rng.standard_normal({})".format(self._z_offset, self._z_offset + n_z, n_z))
+
+        exprs = {
+            Op.MUL_CONST: "{src} * {const}",
+            Op.ADD_CONST: "{src} + {const}",
+            Op.ABS: "np.abs({src})",
+            Op.G: "g_func({src})",
+            Op.EXP: "np.exp({src})",
+            Op.MUL: "{src} * {src2}",
+            Op.ADD: "{src} + {src2}",
+        }
+        for k, (op, src, src2, dst, const) in enumerate(self._program):
+            if len(dst) == 1:
+                names = {
+                    "src": "r[{}]".format(src[0]),
+                    "src2": "r[{}]".format(src2[0]),
+                    "dst": "r[{}]".format(dst[0]),
+                    "const": repr(float(const[0])),
+                }
+            else:
+                names = {}
+                for name, value in (("src", src), ("src2", src2), ("dst", dst), ("const", const)):
+                    namespace["{}_{}".format(name, k)] = value
+                    names[name] = "{}_{}".format(name, k) if name == "const" else "r[{}_{}]".format(name, k)
+            lines.append("    {} = {}".format(names["dst"], exprs[op].format(**names)))
+        lines.append("    return r")
+
+        self._sampler_source = "\n".join(lines) + "\n"
+        exec(compile(self._sampler_source, "<ADR specialized sampler>", "exec"), namespace)
+        self._sampler = namespace["_sampler"]
+
+    # Generated functions can't be pickled, rebuild the sampler instead
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_sampler"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._compile_specialized_sampler()
+
+    def _sync_params(self):
+        """
+        Copies the current ADRParam values into phi_l_vals/phi_h_vals.
+        Re-gathered every time rather than tracked, params can be shared between ADRs and value is assigned directly.
+        """
+        self.phi_l_vals[:] = [param.value for param in self._phi_l_params]
+        self.phi_h_vals[:] = [param.value for param in self._phi_h_params]
+
+    def episode_sample(self):
+        self._sync_params()
+        regs = self._regs
+        n_uniform = len(self._uniform)
+
+        uniform = regs[:n_uniform]
+        uniform[:] = self._rng.uniform(self.phi_l_vals, self.phi_h_vals)
+        if self._boundary_override is not None:
+            k, bound = self._boundary_override
+            self._boundary_override = None
+            uniform[k] = (self.phi_l_vals if bound == Bound.LOWER else self.phi_h_vals)[k]
+        # Written before the other ADRDists run so an ADRActionNoise sees this episode's values
+        for dist, sample in zip(self._uniform, uniform.tolist()):
+            dist.last_sample = sample
+
+        if self._sample_fns:
+            regs[n_uniform:self._post_offset] = [sample() for sample in self._sample_fns]
+        self._sampler(self._rng, regs)
+
+        # Other ADRDists already set their own last_sample
+        for dist, sample in zip(self._nodes[self._gauss_offset:], regs[self._gauss_offset:len(self._nodes)].tolist()):
+            dist.last_sample = sample
+        for k, dist in enumerate(self._post_noise, self._post_offset):
+            regs[k] = dist.step_sample()
+        return regs[self._top_idx] # fancy indexing copies, so callers never see the reused buffer
+
+    def episode_sample_batch(self, batch_size):
+        """
+        Samples batch_size independent episodes at once, returned as a (batch_size, len(self.distributions)) array.
+        Boundary samples are left for the next episode_sample.
+        Each distribution's last_sample is set to its (batch_size,) column.
+        """
+        self._sync_params()
+        regs = np.empty((len(self._regs), batch_size), dtype=np.float64)
+        n_uniform = len(self._uniform)
+
+        uniform = regs[:n_uniform]
+        uniform[:] = self._rng.uniform(self.phi_l_vals[:, None], self.phi_h_vals[:, None], size=uniform.shape)
+        for k, (dist, sample) in enumerate(zip(self._others, self._sample_fns), n_uniform):
+            if dist in self._graph_noise:
+                self._step_sample_batch(dist, regs, k)
+            else:
+                regs[k] = [sample() for _ in range(batch_size)]
+        _episode_sample_kernel(self._z_offset, len(self._nodes) - self._gauss_offset, self._program, regs, self._rng)
+        for k, dist in enumerate(self._post_noise, self._post_offset):
+            self._step_sample_batch(dist, regs, k)
+
+        for k, dist in enumerate(self._nodes):
+            dist.last_sample = regs[k]
+        return regs[self._top_idx].T
     
+    def _boundary_weights(self):
+        """
+        Normalized (and cumulative) boundary sample weights, only rebuilt after a weight changes
+        Zero weight parameters (e.g. ADRParam.fixed_boundary) are left out, _samplable_idx maps back into self.parameters
+        """
+        if self._weights_cache is None or self._weights_version != ADRParam.weights_version:
+            weights = np.array([param.get_boundary_sample_weight() for param in self.parameters], dtype=np.float64)
+            self._samplable_idx = np.flatnonzero(weights > 0)
+            weights = weights[self._samplable_idx]
+            self._weights_cache = weights / weights.sum() if len(weights) else weights
+            self._cumweights = np.cumsum(self._weights_cache)
+            self._weights_version = ADRParam.weights_version
+        return self._weights_cache
+
     def boundary_sample(self):
-        if self.do_boundary_sample: #this is horrible TODO fix this trash
-            sample_weights = [param.get_boundary_sample_weight() for param in self.parameters]
-            weights_norm = sample_weights / np.sum(sample_weights)
-            self.sample_idx = np.random.choice(len(self.parameters), p=weights_norm)
-            self.parameters[self.sample_idx].set_boundary_sample_flag(True)
+        if self.do_boundary_sample and len(self._boundary_weights()): #this is horrible TODO fix this trash
+            # Inverse CDF over the samplable parameters
+            u = self._rng.random() * self._cumweights[-1]
+            k = min(int(np.searchsorted(self._cumweights, u, side="right")), len(self._cumweights) - 1)
+            self.sample_idx = int(self._samplable_idx[k])
+            self._boundary_override = self._boundary_slots[self.sample_idx]
+            if self._boundary_override is None:
+                # Belongs to a distribution that samples itself, let its ADRUniform pick up the flag
+                self.parameters[self.sample_idx].set_boundary_sample_flag(True)
 
             return self.episode_sample(), self.sample_idx 
         else:
@@ -382,15 +830,25 @@ class ADR():
     def update(self, performance, param_idx=None):
         if param_idx is None:
             param_idx = self.sample_idx 
-        self.parameters[param_idx].update(performance, self.p_thresh)
+        self.parameters[param_idx].update(performance, self._p_thresh_lo, self._p_thresh_hi)
+
+    def update_batch(self, performances, param_idxs=None):
+        """
+        Applies performances from many environments at once, e.g. one per env of a vectorized env.
+        performances[k] is credited to param_idxs[k], or to the last boundary sampled parameter if param_idxs is None.
+        Equivalent to calling update for each pair in order.
+        """
+        performances = np.asarray(performances, dtype=np.float64)
+        if param_idxs is None:
+            param_idxs = np.full(len(performances), self.sample_idx)
+        param_idxs = self._param_first_idx[np.asarray(param_idxs)]
+
+        order = np.argsort(param_idxs, kind="stable")
+        idxs, starts = np.unique(param_idxs[order], return_index=True)
+        for param_idx, p_vals in zip(idxs.tolist(), np.split(performances[order], starts[1:])):
+            self.parameters[param_idx].update_batch(p_vals, self._p_thresh_lo, self._p_thresh_hi)
     
-    #this is really a horrible way to do things
-    #sit down and formulate this on a whiteboard
-    #like it kinda works right now but like no
+    # Summed width of every ADRUniform, nested ones included
     def total_distribution_width(self): 
-        total = 0
-        for dist in self.distributions:
-            total += (dist.phi_h.value - dist.phi_l.value)
-        
-        return total 
-
+        self._sync_params()
+        return float(np.subtract(self.phi_h_vals, self.phi_l_vals).sum())
@@ -1,5 +1,8 @@
+import copy
+import pickle
 import unittest
-from adr import ADRParam, ADRUniform, ADR 
+import numpy as np
+from adr import ADRParam, ADRUniform, ADRAdditiveGaussian, ADRUnbiasedAdditiveGaussian, ADRMultiplicative, ADRActionNoise, ADR 
 
 class TestADRParam(unittest.TestCase):
 
@@ -13,6 +16,10 @@ class TestADRParam(unittest.TestCase):
         self.assertEqual(True, self.param.get_boundary_sample_flag())
 
         self.assertEqual(1, self.param.get_boundary_sample_weight())
+
+        self.assertEqual([0, 2.0], self.param.val_bound)
+        self.param.val_bound = [0.5, 1.5]
+        self.assertEqual([0.5, 1.5], self.param.val_bound)
     
     def test_update(self):
         # Initial Value
@@ -22,38 +29,279 @@ class TestADRParam(unittest.TestCase):
 
         # Update with one full PQ clearly above p_thresh
         for _ in range(10):
-            self.param.update(2.0, p_thresh)
+            self.param.update(2.0, *p_thresh)
         
         self.assertAlmostEqual(1.02, self.param.get_value())
         self.assertEqual(0.02, self.param.delta)
 
         # Update 10 more full PQs
         for _ in range(100):
-            self.param.update(2.0, p_thresh)
+            self.param.update(2.0, *p_thresh)
         
         self.assertAlmostEqual(1.22, self.param.get_value())
         self.assertEqual(0.02, self.param.delta)
 
         # Update downwards past min value
         for _ in range(1000):
-            self.param.update(-2.0, p_thresh)
+            self.param.update(-2.0, *p_thresh)
         
         self.assertAlmostEqual(0, self.param.get_value())
         self.assertEqual(0.02, self.param.delta)
 
         # Update arbitrarily large amount of times within PQ thresh
         for _ in range(10000):
-            self.param.update(0.5, p_thresh)
+            self.param.update(0.5, *p_thresh)
         
         self.assertAlmostEqual(0, self.param.get_value())
         self.assertEqual(0.02, self.param.delta)
 
         # Update upwards past max value
         for _ in range(10000):
-            self.param.update(2, p_thresh)
+            self.param.update(2, *p_thresh)
         
         self.assertAlmostEqual(2.0, self.param.get_value())
         self.assertEqual(0.02, self.param.delta)
 
+    def test_update_batch(self):
+        batch_param = ADRParam(1.0, [0, 2.0], delta=0.02, pq_size=10, boundary_sample_weight=1)
+        p_thresh = [-1, 1]
+        rng = np.random.default_rng(0)
+        for size in [3, 7, 10, 25, 1, 0, 44]:
+            p_vals = rng.uniform(-4, 4, size) + rng.choice([-2, 2])
+            for p_val in p_vals:
+                self.param.update(p_val, *p_thresh)
+            batch_param.update_batch(p_vals, *p_thresh)
+            self.assertAlmostEqual(self.param.get_value(), batch_param.get_value())
+            # Both queues must be equally full, so one more performance at a time flushes them together
+            scalar_probe, batch_probe = copy.copy(self.param), copy.copy(batch_param)
+            for _ in range(scalar_probe.pq_size):
+                scalar_probe.update(2.0, *p_thresh)
+                batch_probe.update_batch([2.0], *p_thresh)
+                self.assertAlmostEqual(scalar_probe.get_value(), batch_probe.get_value())
+
+class TestADR(unittest.TestCase):
+
+    def setUp(self):
+        self.grav = ADRUniform.centered_around(8.0, 9.8, 11.0, delta=0.5, pq_size=2, name="gravity")
+        self.mass = ADRUniform.fixed_value(0.1, name="mass")
+        self.adr = ADR([self.grav, self.mass], p_thresh=[-1, 1])
+
+    def test_episode_sample(self):
+        lam = self.adr.episode_sample()
+        self.assertEqual(2, len(lam))
+        self.assertAlmostEqual(9.8, lam[0])
+        self.assertAlmostEqual(0.1, lam[1])
+        self.assertAlmostEqual(9.8, self.grav.get_last_sample())
+
+        # Expand the upper bound of gravity, the sampled range should follow
+        for _ in range(2):
+            self.grav.phi_h.update(2.0, *self.adr.p_thresh)
+        self.assertAlmostEqual(10.3, self.grav.phi_h.get_value())
+        for _ in range(100):
+            lam = self.adr.episode_sample()
+            self.assertTrue(9.8 <= lam[0] <= 10.3)
+        self.assertAlmostEqual(10.3, self.adr.phi_h_vals[0])
+        self.assertAlmostEqual(0.5, self.adr.total_distribution_width())
+
+    def test_shared_params(self):
+        # Every ADR over the same distributions sees updates, e.g. one ADR per env of a vectorized env
+        other = ADR([self.grav, self.mass], p_thresh=[-1, 1])
+        for _ in range(2):
+            self.grav.phi_h.update(2.0, *self.adr.p_thresh)
+        self.adr.episode_sample()
+        other.episode_sample()
+        self.assertAlmostEqual(10.3, other.phi_h_vals[0])
+
+        # Assigning value directly is picked up too
+        self.grav.phi_l.value = 9.0
+        self.assertAlmostEqual(1.3, other.total_distribution_width())
+        self.assertTrue(all(9.0 <= lam[0] <= 10.3 for lam in other.episode_sample_batch(50)))
+
+    def test_boundary_sample(self):
+        for _ in range(2):
+            self.grav.phi_h.update(2.0, *self.adr.p_thresh)
+        for _ in range(20):
+            lam, idx = self.adr.boundary_sample()
+            self.assertIn(idx, [0, 1]) # fixed values have no boundary sample weight
+            self.assertAlmostEqual(self.adr.parameters[idx].get_value(), lam[0])
+
+    def test_episode_sample_batch(self):
+        for _ in range(2):
+            self.grav.phi_h.update(2.0, *self.adr.p_thresh)
+        lam = self.adr.episode_sample_batch(500)
+        self.assertEqual((500, 2), lam.shape)
+        self.assertTrue(np.all((9.8 <= lam[:, 0]) & (lam[:, 0] <= 10.3)))
+        np.testing.assert_array_equal(np.full(500, 0.1), lam[:, 1])
+        np.testing.assert_array_equal(lam[:, 0], self.grav.get_last_sample())
+
+        noise = ADRUnbiasedAdditiveGaussian(5.0, ADRUniform.fixed_value(1.0), alpha=1.0)
+        noise.name = "noise"
+        lam = ADR([noise]).episode_sample_batch(2000)
+        self.assertAlmostEqual(5.0, lam.mean(), delta=0.15)
+        self.assertAlmostEqual(1.0, lam.std(), delta=0.15)
+
+    def test_specialized_sampler(self):
+        def make_adr():
+            lam_i = ADRUniform.centered_around(-1.0, 0.0, 1.0, name="lam_i")
+            lam_j = ADRUniform.centered_around(-1.0, 0.0, 1.0, name="lam_j")
+            additive = ADRAdditiveGaussian(1.0, lam_i, lam_j, alpha=0.5)
+            mult = ADRMultiplicative(2.0, lam_i, lam_j, alpha=0.5)
+            nested = ADRUnbiasedAdditiveGaussian(0.0, additive, alpha=0.1)
+            additive.name, mult.name, nested.name = "additive", "mult", "nested"
+            return ADR([lam_i, additive, mult, nested], rng=42)
+
+        # The generated sampler and the generic kernel consume the same random stream in the same order
+        adr_a, adr_b = make_adr(), make_adr()
+        for _ in range(5):
+            np.testing.assert_allclose(adr_a.episode_sample(), adr_b.episode_sample_batch(1)[0])
+
+        adr_c = pickle.loads(pickle.dumps(adr_a))
+        np.testing.assert_array_equal(adr_a.episode_sample(), adr_c.episode_sample())
+
+    def test_boundary_sample_weight(self):
+        self.grav.phi_l.set_boundary_sample_weight(0)
+        for _ in range(20):
+            _, idx = self.adr.boundary_sample()
+            self.assertEqual(1, idx)
+
+        # Nothing left to boundary sample, falls back to a plain episode sample
+        self.grav.phi_h.set_boundary_sample_weight(0)
+        lam, idx = self.adr.boundary_sample()
+        self.assertEqual(0, idx)
+        self.assertEqual(2, len(lam))
+
+        # Assigning the attribute directly invalidates the cached weights too
+        self.grav.phi_h.boundary_sample_weight = 1
+        for _ in range(20):
+            _, idx = self.adr.boundary_sample()
+            self.assertEqual(1, idx)
+
+    def test_update_batch(self):
+        # Two full pqs above threshold for phi_h, one below for phi_l (whose delta is negative)
+        self.adr.update_batch([2.0, 2.0, -2.0, 2.0, -2.0, 2.0], [1, 1, 0, 1, 0, 1])
+        self.assertAlmostEqual(10.8, self.grav.phi_h.get_value())
+        self.assertAlmostEqual(9.8, self.grav.phi_l.get_value())
+
+        self.adr.sample_idx = 0
+        self.adr.update_batch([2.0, 2.0])
+        self.assertAlmostEqual(9.3, self.grav.phi_l.get_value())
+
+        # One ADRParam at several indices shares one queue, in order
+        shared = ADRUniform.centered_around(-1.0, 0.0, 1.0, delta=0.5, pq_size=2, name="shared")
+        a, b = ADRUnbiasedAdditiveGaussian(0.0, shared), ADRUnbiasedAdditiveGaussian(0.0, shared)
+        a.name, b.name = "a", "b"
+        adr = ADR([a, b], p_thresh=[-1, 1])
+        adr.update_batch([-5.0, 5.0, -5.0, 5.0], [1, 3, 1, 3])
+        self.assertAlmostEqual(0.0, shared.phi_h.get_value())
+
+    def test_seeded_rng(self):
+        def make_adr():
+            grav = ADRUniform.centered_around(8.0, 9.8, 11.0, delta=0.5, pq_size=2, name="gravity")
+            noise = ADRUnbiasedAdditiveGaussian(0.0, ADRUniform.fixed_value(1.0), alpha=1.0)
+            noise.name = "noise"
+            return ADR([grav, noise], p_thresh=[-1, 1], rng=1234)
+
+        adr_a, adr_b = make_adr(), make_adr()
+        for _ in range(10):
+            np.testing.assert_array_equal(adr_a.episode_sample(), adr_b.episode_sample())
+            lam_a, idx_a = adr_a.boundary_sample()
+            lam_b, idx_b = adr_b.boundary_sample()
+            self.assertEqual(idx_a, idx_b)
+            np.testing.assert_array_equal(lam_a, lam_b)
+
+    def test_gaussian_sample(self):
+        # g(|1.0 * 1.0|) = 1 so this should be a standard normal centered on 5
+        inner = ADRUnbiasedAdditiveGaussian(0.0, ADRUniform.fixed_value(1.0), alpha=1.0)
+        outer = ADRUnbiasedAdditiveGaussian(5.0, ADRUniform.fixed_value(1.0), alpha=1.0)
+        nested = ADRUnbiasedAdditiveGaussian(0.0, inner, alpha=0.0)
+        outer.name, nested.name = "outer", "nested"
+        adr = ADR([outer, nested])
+
+        samples = np.array([adr.episode_sample() for _ in range(2000)])
+        self.assertEqual((2000, 2), samples.shape)
+        self.assertAlmostEqual(5.0, samples[:, 0].mean(), delta=0.15)
+        self.assertAlmostEqual(1.0, samples[:, 0].std(), delta=0.15)
+        self.assertEqual(samples[-1, 0], outer.get_last_sample())
+        self.assertEqual(samples[-1, 1], nested.get_last_sample())
+        self.assertIsNotNone(inner.get_last_sample())
+
+    def test_gaussian_noise_sample(self):
+        seen = []
+        class RecordingNoise(ADRActionNoise):
+            def step_sample(self):
+                seen.append((self.lam_i.get_last_sample(), self.lam_j.get_last_sample()))
+                return super().step_sample()
+
+        u = ADRUniform.centered_around(-1.0, 0.0, 1.0, name="u")
+        g = ADRUnbiasedAdditiveGaussian(0.0, u)
+        lam_j = ADRUniform.centered_around(-1.0, 0.0, 1.0, name="lam_j")
+        noise = RecordingNoise(1.0, g, lam_j, ADRUniform.fixed_value(0.0, name="lam_k"))
+        g.name, noise.name = "g", "noise"
+        adr = ADR([u, g, noise], rng=0)
+
+        for _ in range(5):
+            lam = adr.episode_sample()
+            self.assertEqual(lam[0], u.get_last_sample())
+            self.assertEqual(lam[1], g.get_last_sample())
+            self.assertEqual(seen[-1], (lam[1], lam_j.get_last_sample()))
+        seen.clear()
+        lam = adr.episode_sample_batch(4)
+        np.testing.assert_array_equal(lam[:, 0], u.get_last_sample())
+        np.testing.assert_array_equal([lam for lam, _ in seen], lam[:, 1])
+        np.testing.assert_array_equal([lam for _, lam in seen], lam_j.get_last_sample())
+
+    def test_boundary_sample_step_sampled(self):
+        # lam_k samples itself every step, so a boundary sample on it has to reach it through the flag
+        lam_k = ADRUniform(ADRParam.fixed_boundary(0.0), ADRParam(100.0, [0.0, 200.0]))
+        noise = ADRActionNoise(1.0, ADRUniform.fixed_value(0.0), ADRUniform.fixed_value(0.0), lam_k)
+        noise.name = "noise"
+        adr = ADR([noise])
+
+        for _ in range(5):
+            _, idx = adr.boundary_sample()
+            self.assertIs(lam_k.phi_h, adr.parameters[idx])
+            self.assertEqual(100.0, lam_k.get_last_sample())
+
+    def test_composed_distributions(self):
+        lam_i = ADRUniform.centered_around(-1.0, 0.0, 1.0, name="lam_i")
+        lam_j = ADRUniform.centered_around(-1.0, 0.0, 1.0, name="lam_j")
+        additive = ADRAdditiveGaussian(1.0, lam_i, lam_j, alpha=0.5)
+        mult = ADRMultiplicative(2.0, lam_i, lam_j, alpha=0.5)
+        noise = ADRActionNoise(1.0, lam_i, lam_j, ADRUniform.fixed_value(0.0, name="lam_k"))
+        additive.name, mult.name, noise.name = "additive", "mult", "noise"
+        adr = ADR([additive, mult, noise])
+
+        self.assertEqual(14, len(adr.parameters))
+        self.assertTrue(all(isinstance(param, ADRParam) for param in adr.parameters))
+        for _ in range(10):
+            lam = adr.episode_sample()
+            self.assertGreaterEqual(lam[0], 1.0)
+            self.assertGreater(lam[1], 0.0)
+            self.assertEqual(lam[2], noise.get_last_sample())
+        self.assertIsInstance(noise.step_sample(), float)
+
+    def test_shared_uniform_sample(self):
+        seen = []
+        class RecordingNoise(ADRActionNoise):
+            def step_sample(self):
+                seen.append((self.lam_i.get_last_sample(), self.lam_j.get_last_sample()))
+                return super().step_sample()
+
+        lam_i = ADRUniform.centered_around(-1.0, 0.0, 1.0, name="lam_i")
+        lam_j = ADRUniform.centered_around(-1.0, 0.0, 1.0, name="lam_j")
+        additive = ADRAdditiveGaussian(1.0, lam_i, lam_j, alpha=0.5)
+        noise = RecordingNoise(1.0, lam_i, lam_j, ADRUniform.fixed_value(0.0, name="lam_k"))
+        additive.name, noise.name = "additive", "noise"
+        adr = ADR([additive, noise])
+
+        for _ in range(5):
+            adr.episode_sample()
+            self.assertEqual(seen[-1], (lam_i.get_last_sample(), lam_j.get_last_sample()))
+        seen.clear()
+        adr.episode_sample_batch(4)
+        self.assertEqual(4, len(seen))
+        np.testing.assert_array_equal([lam for lam, _ in seen], lam_i.get_last_sample())
+        np.testing.assert_array_equal([lam for _, lam in seen], lam_j.get_last_sample())
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file